@@ -1,8 +1,45 @@
 from typing import Iterable, Union
 from warnings import warn
 from io import SEEK_CUR, SEEK_SET, SEEK_END
+from textwrap import dedent
 
 _INITIAL_CAPACITY = 16
+_GROWTH_FACTOR = 1.5
+_MIN_GROWTH_FACTOR = 1.01
+_MAX_CAPACITY = (1 << 31) - 1
+_BLOCK_MASK = (1 << 56) - 1
+_SPAN_THRESHOLD = 64
+_MASK_HI = tuple((255 << r) & 255 for r in range(8))
+_MASK_LO = tuple(255 >> (8 - r) if r else 0 for r in range(8))
+
+
+# Writers of a byte span into a target, one per bit offset. The ones for
+# misaligned offsets are generated with the offset and masks as literals,
+# and shift the whole span as a single integer.
+_WRITER_TEMPLATE = """
+    def _write_r{r}(target, position, src, offset, size):
+        end = position + size + 1
+        word = int.from_bytes(target[position:end], 'little')
+        payload = int.from_bytes(src[offset:offset + size], 'little') << {r}
+        keep = {mask_lo} | ({mask_hi} << (size << 3))
+        target[position:end] = ((word & keep) | payload).to_bytes(size + 1, 'little')
+"""
+
+
+def _write_r0(target: bytearray, position: int, src: Union[bytearray, bytes], offset: int, size: int):
+    target[position:position + size] = src[offset:offset + size]
+
+
+def _make_writers():
+    writers = [_write_r0]
+    for r in range(1, 8):
+        namespace = {}
+        exec(dedent(_WRITER_TEMPLATE.format(r=r, mask_lo=_MASK_LO[r], mask_hi=_MASK_HI[r])), namespace)
+        writers.append(namespace[f'_write_r{r}'])
+    return tuple(writers)
+
+
+_WRITERS = _make_writers()
 
 
 class UnsupportedError(Exception):
@@ -11,16 +48,37 @@ class UnsupportedError(Exception):
     """
 
 
+class _ClosedTarget:
+    """
+    Stands in for the underlying buffer of a closed stream, so further
+    I/O fails (like in io streams) without checking it on every call.
+    """
+
+    def _fail(self, *args):
+        raise ValueError("I/O operation on closed buffer")
+
+    __len__ = __getitem__ = __setitem__ = __delitem__ = __iter__ = __bytes__ = _fail
+
+
+_CLOSED_TARGET = _ClosedTarget()
+
+
 class Buffer:
     """
     A buffer is a special kind of buffered stream which also accounts
     for misaligned reads and writes (e.g. bits being read and written).
     """
 
-    def __init__(self, initial_capacity: int = _INITIAL_CAPACITY, target: bytearray = None):
+    def __init__(self, initial_capacity: int = _INITIAL_CAPACITY, target: bytearray = None,
+                 growth_factor: float = _GROWTH_FACTOR):
         # Length & position vars.
-        self.bit_position = 0
+        self._bit_position = 0
+        self._byte_position = 0
         self._bit_length = 0
+        self._closed = False
+
+        # Growth vars.
+        self.growth_factor = growth_factor
 
         if target is not None:
             len_ = len(target)
@@ -47,7 +105,7 @@ class Buffer:
         The current length, in bytes (rounded up).
         """
 
-        return self._bit_length >> 3 + (1 if self._bit_length & 7 else 0)
+        return (self._bit_length + 7) >> 3
 
     @length.setter
     def length(self, value: int):
@@ -56,7 +114,7 @@ class Buffer:
         if value > self.capacity:
             self._grow(value - self.capacity)
         self._bit_length = value << 3
-        self.bit_position = min(value << 3, self.bit_position)
+        self.bit_position = min(value << 3, self._bit_position)
 
     def __len__(self):
         """
@@ -65,13 +123,31 @@ class Buffer:
 
         return self.length
 
+    @property
+    def bit_position(self):
+        """
+        The current position, in bits.
+        """
+
+        return self._bit_position
+
+    @bit_position.setter
+    def bit_position(self, value: int):
+        """
+        Sets the current position, in bits.
+        :param value: The position, in bits, to set.
+        """
+
+        self._bit_position = value
+        self._byte_position = value >> 3
+
     @property
     def position(self):
         """
         The current position, in bytes (rounded down).
         """
 
-        return self.bit_position >> 3
+        return self._byte_position
 
     @position.setter
     def position(self, value: int):
@@ -96,7 +172,7 @@ class Buffer:
         Whether the current length of the contents is in multiples of 8.
         """
 
-        return self.bit_position & 7 == 0
+        return self._bit_position & 7 == 0
 
     @property
     def capacity(self):
@@ -120,20 +196,48 @@ class Buffer:
     def _set_capacity(self, value: int):
         if not self._resizable:
             raise UnsupportedError("Can't resize non resizable buffer")
-        new_array = bytearray(value)
-        len_ = min(value, self.capacity)
-        new_array[:len_] = self._target[:len_]
-        if value < self.capacity:
+        capacity = self.capacity
+        if value < capacity:
             self.bit_position = value << 3
-        self._target = new_array
+        try:
+            if value > capacity:
+                self._target.extend(bytes(value - capacity))
+            else:
+                del self._target[value:]
+        except BufferError:
+            # The current array is exported somewhere (e.g. a memoryview),
+            # so it cannot be resized in place: copy it instead.
+            new_array = bytearray(value)
+            len_ = min(value, capacity)
+            new_array[:len_] = self._target[:len_]
+            self._target = new_array
 
     def _grow(self, delta: int):
-        value = delta + self.capacity
-        if self.capacity >= (1 << 30):
-            new_capacity = max(value, (1 << 31) - 1)
+        capacity = self.capacity
+        value = delta + capacity
+        if self._growth_factor == _GROWTH_FACTOR:
+            grown = capacity + (capacity >> 1) + 128
         else:
-            new_capacity = max(max(value, 256), self.capacity * 2)
-        self._set_capacity(new_capacity)
+            grown = int(capacity * self._growth_factor) + 128
+        self._set_capacity(max(value, min(grown, _MAX_CAPACITY)))
+
+    @property
+    def growth_factor(self):
+        """
+        The factor by which the underlying buffer capacity grows.
+        """
+
+        return self._growth_factor
+
+    @growth_factor.setter
+    def growth_factor(self, value: float):
+        """
+        Sets the growth factor. Factors too close to 1 would grow the
+        buffer by a few bytes at a time, so they fall back to 1.5.
+        :param value: The new growth factor.
+        """
+
+        self._growth_factor = value if value >= _MIN_GROWTH_FACTOR else _GROWTH_FACTOR
 
     @property
     def target(self):
@@ -159,18 +263,40 @@ class Buffer:
         :param whence: The reference point.
         """
 
-        def _clamp(v):
-            return max(0, min(self.capacity << 3, v))
-
         if whence == SEEK_SET:
-            self.bit_position = _clamp(offset << 3)
+            self.seek_set(offset)
         elif whence == SEEK_CUR:
-            self.bit_position = _clamp(self.bit_position + offset << 3)
+            self.seek_cur(offset)
         elif whence == SEEK_END:
-            self.bit_position = _clamp((self.capacity - offset) << 3)
+            self.seek_end(offset)
         else:
             raise ValueError(f"Invalid seek origin: {whence}")
 
+    def seek_set(self, offset: int):
+        """
+        Same as seek(offset, SEEK_SET).
+        :param offset: The offset to seek.
+        """
+
+        self.bit_position = max(0, min(len(self._target) << 3, offset << 3))
+
+    def seek_cur(self, offset: int):
+        """
+        Same as seek(offset, SEEK_CUR).
+        :param offset: The offset to seek.
+        """
+
+        self.bit_position = max(0, min(len(self._target) << 3, self._bit_position + (offset << 3)))
+
+    def seek_end(self, offset: int):
+        """
+        Same as seek(offset, SEEK_END).
+        :param offset: The offset to seek.
+        """
+
+        capacity = len(self._target)
+        self.bit_position = max(0, min(capacity << 3, (capacity - offset) << 3))
+
     def tell(self):
         """
         The position to tell is byte-wise.
@@ -183,9 +309,12 @@ class Buffer:
 
     def close(self):
         """
-        Nothing to do here.
+        Closes the stream. Further I/O raises ValueError.
         """
 
+        self._closed = True
+        self._target = _CLOSED_TARGET
+
     def seekable(self):
         """
         This stream is seekable, despite it being dangerous.
@@ -212,11 +341,11 @@ class Buffer:
 
     def closed(self):
         """
-        This stream is never closed.
-        :return: False
+        Whether this stream was closed.
+        :return: True if closed.
         """
 
-        return False
+        return self._closed
 
     def truncate(self, l: int = 0):
         """
@@ -250,16 +379,64 @@ class Buffer:
         :return: The number of bytes read.
         """
 
-        max_length = self.capacity - self.position - 1 + int(self.bit_aligned)
-        if size < 0:
-            size = len(into)
-        len_ = min(size, max_length)
-        for idx in range(len_):
-            into[offset + idx] = self._read_byte()
+        room = max(0, len(into) - offset)
+        if size < 0 or size > room:
+            size = room
+        len_ = min(size, self._bytes_available())
+        if self.bit_aligned:
+            position = self._byte_position
+            # A bytearray copies any other kind of source before assigning
+            # it, so the view only pays off for other kinds of arrays.
+            if type(into) is bytearray:
+                source = self._target
+            else:
+                self._check_closed()
+                source = memoryview(self._target)
+            into[offset:offset + len_] = source[position:position + len_]
+            self._bit_position += len_ << 3
+            self._byte_position = position + len_
+        elif len_ > _SPAN_THRESHOLD:
+            self._read_misaligned_span(into, offset, len_)
+        else:
+            self._read_misaligned_block(into, offset, len_)
+        if len_:
+            self._clamp_to_length()
         return len_
 
     readinto1 = readinto
 
+    def peek(self, size: int = -1):
+        """
+        Gets a read-only view of the next bytes, without copying them
+        and without moving the position. The stream must be aligned.
+        While the view is alive, growing the buffer will copy it to a
+        new array, which the view will not reflect.
+        :param size: The size to view. A negative value views all.
+        :return: The view.
+        """
+
+        self._check_closed()
+        if not self.bit_aligned:
+            raise UnsupportedError("Cannot view a misaligned stream")
+        position = self.position
+        len_ = max(0, self.length - position)
+        if 0 <= size < len_:
+            len_ = size
+        return memoryview(self._target)[position:position + len_].toreadonly()
+
+    def read_view(self, size: int = -1):
+        """
+        Like peek, but also moves the position past the viewed bytes.
+        :param size: The size to read. A negative value reads all.
+        :return: The view.
+        """
+
+        view = self.peek(size)
+        if view:
+            self.bit_position += len(view) << 3
+            self._clamp_to_length()
+        return view
+
     def read(self, size: int = -1):
         """
         Reads data into a new byte array, up to certain length.
@@ -267,9 +444,11 @@ class Buffer:
         :return: The bytes read (the array).
         """
 
-        arr = bytearray(self.length)
-        len_ = self.readinto(arr, offset=0, size=size)
-        return arr[:len_]
+        available = self._bytes_available()
+        len_ = available if size < 0 else min(size, available)
+        arr = bytearray(len_)
+        self.readinto(arr, 0, len_)
+        return arr
 
     read1 = read
 
@@ -289,22 +468,29 @@ class Buffer:
         :param size: The size to write. A negative value reads all.
         """
 
-        position = self.position
-        len_ = len(b)
+        bit_position = self._bit_position
+        position = bit_position >> 3
+        r = bit_position & 7
+        appending = bit_position >= self._bit_length
+        len_ = max(0, len(b) - offset)
         if size < 0:
             size = len_
         elif size > len_:
             size = len_
-
-        if self.bit_aligned:
-            if position + size >= self.capacity:
-                self._grow(size)
-            self._target[position:position + size] = b[offset:offset + size]
+        if size == 0:
+            return 0
+
+        target = self._target
+        if position + size + (1 if r else 0) >= len(target):
+            self._grow(size)
+            target = self._target
+        _WRITERS[r](target, position, b, offset, size)
+        self._bit_position = bit_position + (size << 3)
+        self._byte_position = (bit_position >> 3) + size
+        if appending:
+            self._update_length_appending()
         else:
-            if position + size + 1 >= self.capacity:
-                self._grow(size)
-            for idx in range(size):
-                self._write_misaligned(b[offset + idx])
+            self._update_length()
 
         return size
 
@@ -331,7 +517,11 @@ class Buffer:
         :return: A byte, or -1 on EOF.
         """
 
-        return self._read_byte() if self._has_data_to_read() else -1
+        if not self._has_data_to_read():
+            return -1
+        value = self._read_byte()
+        self._clamp_to_length()
+        return value
 
     def read_bit(self):
         """
@@ -339,11 +529,53 @@ class Buffer:
         :return: The bit (as bool) or None.
         """
 
-        if self.bit_position >= self.bit_length:
+        bit_position = self._bit_position
+        if bit_position >= self._bit_length:
             return None
-        b = self._target[self.position]
-        self.bit_position += 1
-        return b & (1 << (self.bit_position & 7)) != 0
+        self._bit_position = bit_position + 1
+        self._byte_position = (bit_position + 1) >> 3
+        return self._target[bit_position >> 3] & (1 << (bit_position & 7)) != 0
+
+    def read_bits(self, n: int):
+        """
+        Reads n bits at once, as an unsigned integer (the first bit
+        being the least significant one). On EOF, returns None.
+        :param n: The number of bits to read.
+        :return: The bits (as int) or None.
+        """
+
+        if n < 0:
+            raise ValueError("Cannot read a negative number of bits")
+        bit_position = self._bit_position
+        if bit_position + n > self._bit_length:
+            return None
+        r = bit_position & 7
+        p = bit_position >> 3
+        raw = int.from_bytes(self._target[p:p + ((n + r + 7) >> 3)], 'little')
+        self._bit_position = bit_position + n
+        self._byte_position = (bit_position + n) >> 3
+        return (raw >> r) & ((1 << n) - 1)
+
+    def unpack_bits_to_ndarray(self, n: int):
+        """
+        Reads up to n bits at once, into a numpy array of uint8 having
+        one element (0 or 1) per bit. This method requires numpy.
+        :param n: The number of bits to read.
+        :return: The array of bits.
+        """
+
+        import numpy as np
+
+        self._check_closed()
+        bit_position = self._bit_position
+        n = max(0, min(n, self._bit_length - bit_position))
+        r = bit_position & 7
+        p = bit_position >> 3
+        end = p + ((n + r + 7) >> 3)
+        bits = np.unpackbits(np.frombuffer(memoryview(self._target)[p:end], dtype=np.uint8), bitorder='little')
+        self._bit_position = bit_position + n
+        self._byte_position = (bit_position + n) >> 3
+        return bits[r:r + n]
 
     def write_byte(self, value: int):
         """
@@ -353,59 +585,185 @@ class Buffer:
 
         if value < 0 or value > 255:
             raise ValueError("Value to write must be in range(0, 256)")
-        if self.bit_aligned:
-            if self.position + 1 >= self.capacity:
+        bit_position = self._bit_position
+        pos = bit_position >> 3
+        if bit_position & 7 == 0:
+            if pos + 1 >= len(self._target):
                 self._grow(1)
-            self._target[self.position] = value
-            self.position += 1
+            self._target[pos] = value
+            self._bit_position = bit_position + 8
+            self._byte_position = pos + 1
         else:
-            if self.position + 2 >= self.capacity:
+            if pos + 2 >= len(self._target):
                 self._grow(1)
             self._write_misaligned(value)
         self._update_length()
 
+    def write_byte_aligned(self, value: int):
+        """
+        Writes a single byte, assuming the stream is bit-aligned. This
+        is faster than write_byte, but the caller must ensure that the
+        stream is actually aligned.
+        :param value: The byte to write.
+        """
+
+        p = self._bit_position >> 3
+        if p >= len(self._target):
+            self._grow(1)
+        self._target[p] = value
+        bit_position = (p + 1) << 3
+        self._bit_position = bit_position
+        self._byte_position = p + 1
+        if bit_position > self._bit_length:
+            self._bit_length = bit_position
+
     def write_bit(self, bit: bool):
         """
         Writes a single bit.
         :param bit: The bit to write.
         """
 
-        p = self.position
-        if self.bit_aligned and self.position == self.capacity:
+        bit_position = self._bit_position
+        pos = bit_position >> 3
+        r = bit_position & 7
+        if pos >= len(self._target):
             self._grow(1)
-        r = self.bit_position & 7
-        self._target[p] = (self._target[p] & ~(1 << r)) | (int(bit) << r)
-        self.bit_position += 1
+        target = self._target
+        target[pos] = (target[pos] & ~(1 << r)) | (int(bit) << r)
+        self._bit_position = bit_position + 1
+        self._byte_position = (bit_position + 1) >> 3
+        self._update_length()
+
+    def write_bits(self, value: int, n: int):
+        """
+        Writes n bits at once, from an unsigned integer (the least
+        significant bit being written first).
+        :param value: The bits to write.
+        :param n: The number of bits to write.
+        """
+
+        if n < 0:
+            raise ValueError("Cannot write a negative number of bits")
+        if value < 0 or value >> n:
+            raise ValueError(f"Value to write must be in range(0, {1 << n})")
+        bit_position = self._bit_position
+        r = bit_position & 7
+        p = bit_position >> 3
+        end = p + ((n + r + 7) >> 3)
+        target = self._target
+        capacity = len(target)
+        if end > capacity:
+            self._grow(end - capacity)
+            target = self._target
+        word = int.from_bytes(target[p:end], 'little')
+        mask = ((1 << n) - 1) << r
+        target[p:end] = ((word & ~mask) | (value << r)).to_bytes(end - p, 'little')
+        self._bit_position = bit_position + n
+        self._byte_position = (bit_position + n) >> 3
         self._update_length()
 
+    def write_bytes_packed(self, src: Union[bytearray, bytes], bit_count: int):
+        """
+        Writes the first bit_count bits of an already packed source (the
+        bits of each byte being taken from the least significant one).
+        :param src: The packed bits source.
+        :param bit_count: The number of bits to write.
+        """
+
+        if bit_count < 0 or bit_count > len(src) << 3:
+            raise ValueError(f"Bit count must be in range(0, {(len(src) << 3) + 1})")
+        full_bytes = bit_count >> 3
+        tail_bits = bit_count & 7
+        self.write(src, 0, full_bytes)
+        if tail_bits:
+            self.write_bits(src[full_bytes] & _MASK_LO[tail_bits], tail_bits)
+
     # Private methods:
 
+    def _check_closed(self):
+        # Needed before memoryview() calls, which fail with a TypeError
+        # on the closed target instead.
+        if self._closed:
+            raise ValueError("I/O operation on closed buffer")
+
     def _has_data_to_read(self):
-        return self.position < self.length
+        return self._bit_position < self._bit_length
+
+    def _clamp_to_length(self):
+        # Reads are rounded up to whole bytes, so they may end past the
+        # contents (and even past the capacity) when the length is not a
+        # multiple of 8.
+        if self._bit_position > self._bit_length:
+            self.bit_position = self._bit_length
+
+    def _bytes_available(self):
+        return max(0, (self._bit_length - self._bit_position + 7) >> 3)
 
     def _read_byte_misaligned(self):
-        r = self.bit_position & 7
-        l = self._target[self.position] >> r
-        self.bit_position += 8
-        u = self._target[self.bit_position >> 3] << (8 - r)
-        return l | u
+        target = self._target
+        bit_position = self._bit_position
+        r = bit_position & 7
+        p = bit_position >> 3
+        self._bit_position = bit_position + 8
+        self._byte_position = p + 1
+        u = target[p + 1] if p + 1 < len(target) else 0
+        return ((target[p] >> r) | (u << (8 - r))) & 255
 
     def _read_byte_aligned(self):
-        u = self._target[self.position]
-        self.position += 1
-        return u
+        p = self._byte_position
+        self._bit_position += 8
+        self._byte_position = p + 1
+        return self._target[p]
 
     def _read_byte(self):
         return self._read_byte_aligned() if self.bit_aligned else self._read_byte_misaligned()
 
     def _update_length(self):
-        if self.bit_position > self._bit_length:
-            self._bit_length = self.bit_position
+        bit_position = self._bit_position
+        bit_length = self._bit_length
+        self._bit_length = bit_position if bit_position > bit_length else bit_length
+
+    def _update_length_appending(self):
+        # Only valid when the last write started at (or after) the end.
+        self._bit_length = self._bit_position
 
     def _write_misaligned(self, value: int):
-        r = self.bit_position & 7
+        target = self._target
+        bit_position = self._bit_position
+        r = bit_position & 7
         rc = 8 - r
-        p = self.position
-        self._target[p + 1] = (self._target[p + 1] & (255 << r)) | (value >> rc)
-        self._target[p] = (self._target[p] & (255 >> rc)) | (value << r)
-        self.bit_position += 8
+        p = bit_position >> 3
+        target[p + 1] = (target[p + 1] & _MASK_HI[r]) | (value >> rc)
+        target[p] = (target[p] & _MASK_LO[r]) | ((value << r) & 255)
+        self._bit_position = bit_position + 8
+        self._byte_position = p + 1
+
+    def _read_misaligned_block(self, into: bytearray, offset: int, size: int):
+        # Each 8-byte word starting at the current position holds the 56
+        # shifted bits of 7 whole bytes, so they're extracted at once.
+        target = self._target
+        bit_position = self._bit_position
+        r = bit_position & 7
+        p = bit_position >> 3
+        end = offset + size - size % 7
+        while offset < end:
+            word = int.from_bytes(target[p:p + 8], 'little')
+            into[offset:offset + 7] = ((word >> r) & _BLOCK_MASK).to_bytes(7, 'little')
+            p += 7
+            offset += 7
+        tail = size % 7
+        if tail:
+            word = int.from_bytes(target[p:p + tail + 1], 'little')
+            into[offset:offset + tail] = ((word >> r) & ((1 << (tail << 3)) - 1)).to_bytes(tail, 'little')
+        self._bit_position = bit_position + (size << 3)
+        self._byte_position = (bit_position >> 3) + size
+
+    def _read_misaligned_span(self, into: bytearray, offset: int, size: int):
+        # The whole span is shifted as a single integer, so the per-bit
+        # work happens in C instead of in a Python loop.
+        r = self._bit_position & 7
+        p = self._byte_position
+        word = int.from_bytes(self._target[p:p + size + 1], 'little')
+        into[offset:offset + size] = ((word >> r) & ((1 << (size << 3)) - 1)).to_bytes(size, 'little')
+        self._bit_position += size << 3
+        self._byte_position = p + size
@@ -0,0 +1,198 @@
+from io import SEEK_CUR, SEEK_END
+
+import pytest
+
+from alephvault.binary.buffers import Buffer, UnsupportedError
+
+
+def _bits(data, count):
+    return [(data[idx >> 3] >> (idx & 7)) & 1 for idx in range(count)]
+
+
+@pytest.mark.parametrize("r", range(8))
+@pytest.mark.parametrize("size", [1, 6, 7, 8, 20, 65, 200])
+def test_misaligned_write_read_round_trip(r, size):
+    data = bytes((idx * 37 + 11) & 255 for idx in range(size))
+    buffer = Buffer()
+    buffer.write_bits((1 << r) - 1, r)
+    assert buffer.write(data) == size
+    assert buffer.bit_length == r + (size << 3)
+    buffer.bit_position = r
+    assert buffer.read(size) == data
+    assert buffer.read_bits(1) is None
+
+
+def test_write_offset_past_source_writes_nothing():
+    buffer = Buffer()
+    buffer.write(b'hello')
+    assert buffer.write(b'abc', 5) == 0
+    assert buffer.bit_length == 40
+    assert buffer.position == 5
+
+
+def test_length_rounds_up_partial_bytes():
+    buffer = Buffer()
+    buffer.write(b'ab')
+    buffer.write_bit(True)
+    assert buffer.bit_length == 17
+    assert buffer.length == 3
+    assert len(buffer) == 3
+
+
+def test_read_is_bounded_by_length_not_capacity():
+    buffer = Buffer(initial_capacity=64)
+    buffer.write(b'hello')
+    buffer.position = 0
+    assert buffer.read() == b'hello'
+    assert buffer.read() == b''
+
+
+def test_readinto_respects_offset():
+    buffer = Buffer()
+    buffer.write(b'hello')
+    buffer.position = 0
+    into = bytearray(4)
+    assert buffer.readinto(into, 2) == 2
+    assert into == b'\x00\x00he'
+
+
+def test_read_past_partial_final_byte():
+    buffer = Buffer(initial_capacity=16)
+    buffer.write(bytes(range(1, 16)))
+    buffer.write_bit(True)
+    buffer.seek(0)
+    assert buffer.read_bit() is True
+    count = 0
+    while buffer.read_byte() != -1:
+        count += 1
+    assert count == 15
+    assert buffer.bit_position == buffer.bit_length == 121
+    buffer.write_bit(True)
+    assert buffer.bit_length == 122
+
+
+def test_read_rounds_up_but_stops_at_length():
+    buffer = Buffer()
+    buffer.write_bits(0b101, 3)
+    buffer.bit_position = 0
+    assert buffer.read() == b'\x05'
+    assert buffer.bit_position == 3
+
+
+def test_read_bit_reads_current_bit():
+    buffer = Buffer()
+    buffer.write(b'\x01\x80')
+    buffer.position = 0
+    bits = [buffer.read_bit() for _ in range(16)]
+    assert bits == [True] + [False] * 14 + [True]
+    assert buffer.read_bit() is None
+
+
+def test_read_write_bits():
+    buffer = Buffer()
+    buffer.write_bit(True)
+    buffer.write_bits(0x1234, 13)
+    buffer.write_bits((1 << 70) - 3, 70)
+    assert buffer.bit_length == 84
+    buffer.bit_position = 1
+    assert buffer.read_bits(13) == 0x1234
+    assert buffer.read_bits(70) == (1 << 70) - 3
+    assert buffer.read_bits(1) is None
+
+
+def test_read_write_bits_reject_bad_arguments():
+    buffer = Buffer()
+    buffer.write(b'ab')
+    buffer.bit_position = 5
+    with pytest.raises(ValueError):
+        buffer.read_bits(-3)
+    with pytest.raises(ValueError):
+        buffer.write_bits(8, 3)
+    with pytest.raises(ValueError):
+        buffer.write_bits(0, -1)
+    assert buffer.bit_position == 5
+    assert buffer.bit_length == 16
+
+
+def test_seek_cur_adds_bytes_to_bit_position():
+    buffer = Buffer()
+    buffer.bit_position = 3
+    buffer.seek(2, SEEK_CUR)
+    assert buffer.bit_position == 19
+    buffer.seek_cur(-1)
+    assert buffer.bit_position == 11
+    buffer.seek(-100, SEEK_CUR)
+    assert buffer.bit_position == 0
+
+
+def test_seek_set_and_end_are_clamped():
+    buffer = Buffer(initial_capacity=16)
+    buffer.seek_set(5)
+    assert buffer.position == 5
+    buffer.seek_set(100)
+    assert buffer.position == 16
+    buffer.seek(4, SEEK_END)
+    assert buffer.position == 12
+    buffer.seek_end(-4)
+    assert buffer.position == 16
+    with pytest.raises(ValueError):
+        buffer.seek(0, 9)
+
+
+def test_peek_and_read_view():
+    buffer = Buffer()
+    buffer.write(b'hello')
+    buffer.position = 1
+    assert bytes(buffer.peek(3)) == b'ell'
+    assert buffer.position == 1
+    view = buffer.read_view()
+    assert bytes(view) == b'ello'
+    assert view.readonly
+    assert buffer.position == 5
+    buffer.bit_position = 1
+    with pytest.raises(UnsupportedError):
+        buffer.peek()
+
+
+def test_write_bytes_packed_tail_bits():
+    buffer = Buffer()
+    buffer.write_bit(True)
+    buffer.write_bytes_packed(b'\xab\xff', 12)
+    assert buffer.bit_length == 13
+    assert _bits(buffer.target, 13) == [1] + _bits(b'\xab\x0f', 12)
+    with pytest.raises(ValueError):
+        buffer.write_bytes_packed(b'\x00', 9)
+
+
+def test_write_byte_aligned():
+    buffer = Buffer()
+    for value in range(300):
+        buffer.write_byte_aligned(value & 255)
+    assert buffer.length == 300
+    buffer.position = 0
+    assert buffer.read() == bytes(value & 255 for value in range(300))
+
+
+def test_closed_buffer_rejects_io():
+    buffer = Buffer()
+    buffer.close()
+    assert buffer.closed()
+    with pytest.raises(ValueError):
+        buffer.write(b'a')
+    with pytest.raises(ValueError):
+        buffer.read()
+    with pytest.raises(ValueError):
+        buffer.peek()
+
+
+def test_unpack_bits_to_ndarray():
+    np = pytest.importorskip("numpy")
+    buffer = Buffer()
+    buffer.write(bytes([0b10110010, 0xff]))
+    buffer.bit_position = 3
+    bits = buffer.unpack_bits_to_ndarray(10)
+    assert bits.dtype == np.uint8
+    assert bits.tolist() == [0, 1, 1, 0, 1, 1, 1, 1, 1, 1]
+    assert buffer.bit_position == 13
+    assert buffer.unpack_bits_to_ndarray(100).tolist() == [1, 1, 1]
+    assert buffer.bit_position == 16